@@ -0,0 +1,205 @@
+import os
+import json
+import fnmatch
+import datetime
+import subprocess
+from urllib.parse import urlparse
+import shutil
+import json_store
+import shard_tests
+
+# Written by ContractRenewalSystemTest when RECORD_TEST_URLS is enabled
+TRACE_FILE = "test_reports/url_trace.jsonl"
+
+# Sharded runs only read the index and keep their trace in their report
+# directory; the index is updated when the shard reports are merged
+INDEX_FILE = "test_reports/test_impact_index.json"
+SHARD_TRACE_FILE = "url_trace.jsonl"
+
+# Maintained by hand next to this script: "routes" maps URL path prefixes to the
+# app files (glob patterns, relative to the app repository) that render them.
+# A URL path matches every route that is a prefix of it. Changes to "global"
+# files, or to files that match nothing at all, force a full run; "ignore"
+# files never affect the UI tests.
+ROUTE_MAP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "route_map.json")
+
+# Run the whole suite every N selective runs so the index picks up new routes
+FULL_RUN_EVERY = 10
+
+def load_index(path=INDEX_FILE):
+    """Load the test impact index, or an empty index if none exists"""
+    return json_store.load_json(path, {"tests": {}, "runs_since_full": 0})
+
+def save_index(index, path=INDEX_FILE):
+    """Write the test impact index to disk"""
+    json_store.save_json(path, index)
+
+def load_route_map(path=ROUTE_MAP_FILE):
+    """Load the URL route -> app file mapping"""
+    route_map = json_store.load_json(path, {})
+    return {
+        "routes": route_map.get("routes", {}),
+        "global": route_map.get("global", []),
+        "ignore": route_map.get("ignore", []),
+    }
+
+def start_recording(trace_file=TRACE_FILE):
+    """Make the tests record the pages they visit into a fresh trace file"""
+    if os.path.exists(trace_file):
+        os.remove(trace_file)
+    os.environ['RECORD_TEST_URLS'] = 'True'
+    os.environ['URL_TRACE_FILE'] = trace_file
+
+def read_trace(trace_files=(TRACE_FILE,)):
+    """Return a dict of test name -> set of URL paths visited, from one or more trace files"""
+    visited = {}
+    for trace_file in trace_files:
+        if not os.path.exists(trace_file):
+            continue
+        with open(trace_file) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                paths = visited.setdefault(entry["test"], set())
+                paths.update(urlparse(url).path or "/" for url in entry["urls"])
+    return visited
+
+def files_for_path(url_path, route_map):
+    """Return the file patterns of every route that is a prefix of the URL path"""
+    files = set()
+    for route, patterns in route_map["routes"].items():
+        if url_path.startswith(route):
+            files.update(patterns)
+    return files
+
+def _matches(filename, patterns):
+    """Check whether a file name matches any of the glob patterns"""
+    return any(fnmatch.fnmatch(filename, pattern) for pattern in patterns)
+
+def changed_files_from_git(since="HEAD", app_dir="."):
+    """List files changed in the app repository since the given git revision, plus untracked files"""
+    try:
+        # --relative makes the paths relative to app_dir, like ls-files and the route map
+        changed = subprocess.check_output(
+            ["git", "diff", "--name-only", "--relative", since], cwd=app_dir, text=True)
+        # New views and templates are untracked until committed, and git diff doesn't list them
+        untracked = subprocess.check_output(
+            ["git", "ls-files", "--others", "--exclude-standard"], cwd=app_dir, text=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Could not get changed files from git: {e}")
+        return None
+    files = []
+    for line in (changed + untracked).splitlines():
+        if line and line not in files:
+            files.append(line)
+    return files
+
+def select_tests(test_names, changed_files, index=None, route_map=None, full_run_every=FULL_RUN_EVERY):
+    """Pick the tests affected by the changed files.
+
+    Returns (selected_tests, reason); reason is None for a selective run and
+    explains why the full suite was chosen otherwise.
+    """
+    if index is None:
+        index = load_index()
+    if route_map is None:
+        route_map = load_route_map()
+
+    if changed_files is None:
+        return list(test_names), "changed files unknown"
+    if not changed_files:
+        return list(test_names), "no changed files found"
+    if not index["tests"]:
+        return list(test_names), "no test impact index yet"
+    if index.get("runs_since_full", 0) >= full_run_every:
+        return list(test_names), f"periodic full run (every {full_run_every} runs)"
+
+    mapped = set()
+    for entry in index["tests"].values():
+        mapped.update(entry["files"])
+    for filename in changed_files:
+        if _matches(filename, route_map["global"]):
+            return list(test_names), f"{filename} affects every page"
+        if not _matches(filename, mapped) and not _matches(filename, route_map["ignore"]):
+            return list(test_names), f"{filename} is not mapped to any route"
+
+    selected = []
+    for name in test_names:
+        entry = index["tests"].get(name)
+        # Tests missing from the index have never been traced, so always run them
+        if entry is None or any(_matches(filename, entry["files"]) for filename in changed_files):
+            selected.append(name)
+    return selected, None
+
+def update_index(full_run, trace_files=(TRACE_FILE,), route_map=None, path=INDEX_FILE):
+    """Fold the pages recorded during this run into the test impact index.
+
+    New pages are added to what a test visited before rather than replacing it,
+    so a test that failed halfway does not lose the pages it usually reaches.
+    """
+    if route_map is None:
+        route_map = load_route_map()
+    index = load_index(path)
+    now = datetime.datetime.now().isoformat(timespec="seconds")
+
+    for name, url_paths in read_trace(trace_files).items():
+        url_paths = url_paths | set(index["tests"].get(name, {}).get("urls", []))
+        files = set()
+        for url_path in url_paths:
+            files.update(files_for_path(url_path, route_map))
+        index["tests"][name] = {"urls": sorted(url_paths), "files": sorted(files), "updated": now}
+
+    if full_run:
+        index["runs_since_full"] = 0
+        index["last_full_run"] = now
+    else:
+        index["runs_since_full"] = index.get("runs_since_full", 0) + 1
+    save_index(index, path)
+    return index
+
+def save_shard_trace(report_dir, full_run, index_path=INDEX_FILE):
+    """Keep this shard's trace in its report directory instead of updating the shared index.
+
+    Returns the --affected details to store in the shard manifest.
+    """
+    if os.path.exists(TRACE_FILE):
+        if not os.path.exists(report_dir):
+            os.makedirs(report_dir)
+        shutil.copy2(TRACE_FILE, os.path.join(report_dir, SHARD_TRACE_FILE))
+    return {"full_run": full_run, "index_digest": json_store.digest(load_index(index_path))}
+
+def update_index_from_shards(report_dirs, path=INDEX_FILE):
+    """Fold the traces of merged --affected shard runs into the test impact index"""
+    manifests = [json_store.load_json(os.path.join(report_dir, shard_tests.MANIFEST_FILE), None)
+                 for report_dir in report_dirs]
+    affected = [m["affected"] for m in manifests if m and "affected" in m]
+    if not affected:
+        return None
+    full_run = all(details["full_run"] for details in affected)
+    trace_files = [os.path.join(report_dir, SHARD_TRACE_FILE) for report_dir in report_dirs]
+    index = update_index(full_run, trace_files, path=path)
+    print(f"Test impact index updated: {path}")
+    return index
+
+def plan_run(test_names, since="HEAD", changed_files=None, app_dir=".", full_run_every=FULL_RUN_EVERY,
+             index_path=INDEX_FILE):
+    """Choose which tests to run and start recording the pages they visit.
+
+    Returns (selected_tests, full_run); pass full_run to update_index once
+    the tests have finished.
+    """
+    if changed_files is None:
+        changed_files = changed_files_from_git(since, app_dir)
+    selected, reason = select_tests(test_names, changed_files, index=load_index(index_path),
+                                    full_run_every=full_run_every)
+
+    if reason:
+        print(f"Running all {len(selected)} test(s): {reason}")
+    else:
+        skipped = [name for name in test_names if name not in selected]
+        print(f"Running {len(selected)} affected test(s), skipping {len(skipped)} unaffected: {', '.join(skipped) or 'none'}")
+
+    start_recording()
+    return selected, reason is not None
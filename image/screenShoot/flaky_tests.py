@@ -0,0 +1,213 @@
+import glob
+import datetime
+import unittest
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+import json_store
+
+HISTORY_FILE = "test_reports/flaky_history.json"
+
+def load_history(path=HISTORY_FILE):
+    """Load the per-test flakiness history, or an empty history if none exists"""
+    return json_store.load_json(path, {})
+
+def save_history(history, path=HISTORY_FILE):
+    """Write the per-test flakiness history to disk"""
+    json_store.save_json(path, history)
+
+def flaky_score(history, test_name):
+    """Fraction of recorded runs in which the test only passed on retry"""
+    entry = history.get(test_name)
+    if not entry or not entry.get("runs"):
+        return 0.0
+    return entry.get("flaky", 0) / entry["runs"]
+
+def order_known_flaky_first(test_names, history):
+    """Order tests so known-flaky ones run first and their retries get the first worker slots"""
+    # sorted() is stable, so non-flaky tests keep their original order
+    return sorted(test_names, key=lambda name: -flaky_score(history, name))
+
+def _run_single_test(test_case_class, test_name):
+    """Run one test method in isolation and return its unittest result"""
+    result = unittest.TestResult()
+    test_case_class(test_name).run(result)
+    return result
+
+class RetryScheduler:
+    """Reruns failed tests in a background thread pool, in parallel with each other.
+
+    Retries are only started once the main run has finished, so their output
+    cannot end up in the output the XML runner captures for another test.
+    Each test creates its own WebDriver in setUp, so retries can run side by side.
+    """
+    
+    def __init__(self, test_case_class, max_retries=2, workers=4):
+        self.test_case_class = test_case_class
+        self.max_retries = max_retries
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers))
+        self.futures = {}
+    
+    def submit(self, test_name):
+        """Start retrying a failed test"""
+        if test_name not in self.futures:
+            self.futures[test_name] = self.executor.submit(self._retry, test_name)
+    
+    def _retry(self, test_name):
+        """Return the attempt number the test passed on, or None if it never did"""
+        for attempt in range(1, self.max_retries + 1):
+            if _run_single_test(self.test_case_class, test_name).wasSuccessful():
+                return attempt
+        return None
+    
+    def results(self):
+        """Wait for all retries and return a dict of test name -> passing attempt (or None)"""
+        outcomes = {name: future.result() for name, future in self.futures.items()}
+        self.executor.shutdown()
+        return outcomes
+
+def _test_method_name(test):
+    """Method name of a test as stored in a unittest (or xmlrunner) result list"""
+    # Subtests point at their parent test case
+    test = getattr(test, "test_case", test)
+    name = getattr(test, "_testMethodName", None)
+    if name:
+        return name
+    # xmlrunner stores _TestInfo objects, which only keep the test id
+    test_id = test.id() if callable(getattr(test, "id", None)) else getattr(test, "test_id", "")
+    return test_id.split(" ")[0].rsplit(".", 1)[-1]
+
+def first_attempt_statuses(result, test_names):
+    """Map each test to how its first attempt ended, read from the unittest result.
+
+    Statuses are PASSED, FAILED, ERROR, SKIPPED, EXPECTED_FAILURE or UNEXPECTED_SUCCESS.
+    """
+    statuses = {name: "PASSED" for name in test_names}
+    # Later lists win, so a test that failed and then errored in tearDown counts as ERROR
+    outcome_lists = [
+        ("UNEXPECTED_SUCCESS", [(test, None) for test in result.unexpectedSuccesses]),
+        ("EXPECTED_FAILURE", result.expectedFailures),
+        ("SKIPPED", result.skipped),
+        ("FAILED", result.failures),
+        ("ERROR", result.errors),
+    ]
+    for status, outcomes in outcome_lists:
+        for test, _ in outcomes:
+            name = _test_method_name(test)
+            if name in statuses:
+                statuses[name] = status
+    return statuses
+
+def run_with_retries(test_case_class, test_names, runner, max_retries=2, workers=4):
+    """Run the tests with the given runner, then retry the failures in parallel.
+
+    Known-flaky tests are scheduled first. Returns (result, retry_outcomes),
+    where retry_outcomes maps each failed test to the attempt it passed on, or None.
+    """
+    history = load_history()
+    ordered = order_known_flaky_first(test_names, history)
+    
+    result = runner.run(unittest.TestSuite(test_case_class(name) for name in ordered))
+    first_attempts = first_attempt_statuses(result, ordered)
+    
+    scheduler = RetryScheduler(test_case_class, max_retries, workers)
+    for name in ordered:
+        if first_attempts[name] in ("FAILED", "ERROR"):
+            scheduler.submit(name)
+    if scheduler.futures:
+        print(f"\nRetrying {len(scheduler.futures)} failed test(s)...")
+    retry_outcomes = scheduler.results()
+    print_flaky_summary(retry_outcomes)
+    
+    save_history(update_history(history, first_attempts, retry_outcomes))
+    return result, retry_outcomes
+
+def run_succeeded(result, retry_outcomes):
+    """A run succeeds when every failed test passed on retry and nothing unexpectedly succeeded"""
+    return not result.unexpectedSuccesses and all(attempt is not None for attempt in retry_outcomes.values())
+
+def update_history(history, first_attempts, retry_outcomes):
+    """Record one run of the suite in the flakiness history.
+
+    first_attempts maps each test that ran to the status of its first attempt
+    (PASSED, FAILED, ERROR, SKIPPED, EXPECTED_FAILURE or UNEXPECTED_SUCCESS);
+    retry_outcomes is the dict returned by RetryScheduler.results.
+    """
+    now = datetime.datetime.now().isoformat(timespec="seconds")
+    for name, status in first_attempts.items():
+        entry = history.setdefault(name, {"runs": 0, "passed": 0, "flaky": 0, "failed": 0})
+        if status in ("FAILED", "ERROR"):
+            status = "FLAKY" if retry_outcomes.get(name) is not None else "FAILED"
+        if status == "FLAKY":
+            entry["last_flaky"] = now
+        # Skipped tests did not really run, so they don't count towards the flaky score
+        if status != "SKIPPED":
+            entry["runs"] += 1
+        entry[status.lower()] = entry.get(status.lower(), 0) + 1
+        entry["last_status"] = status
+        entry["last_run"] = now
+    return history
+
+def mark_flaky_in_xml(report_dir, retry_outcomes):
+    """Rewrite the JUnit XML so tests that passed on retry are no longer reported as failures.
+
+    The failure or error of the first attempt is dropped and the testcase gets
+    flaky, rerun and first_attempt properties instead.
+    """
+    flaky = {name: attempt for name, attempt in retry_outcomes.items() if attempt is not None}
+    if not flaky:
+        return
+    
+    for xml_file in glob.glob(f"{report_dir}/*.xml"):
+        try:
+            tree = ET.parse(xml_file)
+        except ET.ParseError as e:
+            print(f"Error parsing XML results {xml_file}: {e}")
+            continue
+        
+        root = tree.getroot()
+        changed = False
+        for suite in root.iter('testsuite'):
+            for testcase in suite.findall('testcase'):
+                attempt = flaky.get(testcase.get('name'))
+                if attempt is None:
+                    continue
+                problems = testcase.findall('failure') + testcase.findall('error')
+                if not problems:
+                    continue
+                for problem in problems:
+                    testcase.remove(problem)
+                properties = testcase.find('properties')
+                if properties is None:
+                    properties = ET.Element('properties')
+                    testcase.insert(0, properties)
+                ET.SubElement(properties, 'property', name="flaky", value="true")
+                ET.SubElement(properties, 'property', name="rerun", value=str(attempt))
+                ET.SubElement(properties, 'property', name="first_attempt", value=problems[0].get('message', ''))
+                changed = True
+            
+            testcases = suite.findall('testcase')
+            suite.set('failures', str(sum(1 for t in testcases if t.find('failure') is not None)))
+            suite.set('errors', str(sum(1 for t in testcases if t.find('error') is not None)))
+        
+        if not changed:
+            continue
+        if root.tag == 'testsuites':
+            suites = root.findall('testsuite')
+            for attribute in ('failures', 'errors'):
+                if root.get(attribute) is not None:
+                    root.set(attribute, str(sum(int(s.get(attribute, 0)) for s in suites)))
+        tree.write(xml_file, encoding="utf-8", xml_declaration=True)
+
+def print_flaky_summary(retry_outcomes):
+    """Print which tests were flaky and which failed for real"""
+    if not retry_outcomes:
+        return
+    flaky = [name for name, attempt in retry_outcomes.items() if attempt is not None]
+    failed = [name for name, attempt in retry_outcomes.items() if attempt is None]
+    print("\n" + "-" * 80)
+    print("RETRY SUMMARY")
+    print("-" * 80)
+    for name in flaky:
+        print(f"  FLAKY  {name} (passed on retry {retry_outcomes[name]})")
+    for name in failed:
+        print(f"  FAILED {name}")
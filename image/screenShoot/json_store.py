@@ -0,0 +1,26 @@
+import os
+import json
+import hashlib
+
+def load_json(path, default):
+    """Load a JSON file, falling back to the default if it is missing or unreadable"""
+    if not os.path.exists(path):
+        return default
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Could not read {path}: {e}")
+        return default
+
+def digest(data):
+    """Short fingerprint of JSON data, used to check that several machines used the same snapshot"""
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()[:12]
+
+def save_json(path, data):
+    """Write data to a JSON file, creating its directory if needed"""
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
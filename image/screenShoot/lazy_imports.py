@@ -0,0 +1,53 @@
+import sys
+import time
+import importlib
+
+# Third-party dependencies the runners may suggest installing, by import name.
+# Anything else (e.g. a local module such as solve) is only reported as missing.
+PIP_NAMES = {
+    "xmlrunner": "unittest-xml-reporting",
+    "selenium": "selenium",
+    "openpyxl": "openpyxl",
+}
+
+# Seconds spent on the first import of each lazily loaded module
+_import_times = {}
+
+def load(module_name):
+    """Import a module on first use, failing fast with an install hint if it is missing"""
+    if module_name in _import_times:
+        return sys.modules[module_name]
+    start = time.perf_counter()
+    try:
+        module = importlib.import_module(module_name)
+    except ImportError as e:
+        # e.name is the module that was actually missing, e.g. selenium for selenium_tests
+        missing = (e.name or module_name).split(".")[0]
+        message = f"Error: could not import '{module_name}' ({e})."
+        if missing in PIP_NAMES:
+            message += f"\nInstall it with: pip install {PIP_NAMES[missing]}"
+        raise SystemExit(message)
+    _import_times[module_name] = time.perf_counter() - start
+    return module
+
+def check_dependencies(*module_names):
+    """Import every module a code path needs up front, so a missing one fails before any test runs"""
+    missing = []
+    for module_name in module_names:
+        try:
+            load(module_name)
+        except SystemExit as e:
+            missing.append(str(e))
+    if missing:
+        raise SystemExit("\n".join(missing))
+
+def print_import_times():
+    """Print how long each lazily loaded module took to import"""
+    print("\n" + "-" * 80)
+    print("STARTUP PROFILE (lazy imports)")
+    print("-" * 80)
+    if not _import_times:
+        print("  No heavy modules were imported")
+    for module_name, seconds in sorted(_import_times.items(), key=lambda item: -item[1]):
+        print(f"  {seconds * 1000:8.1f} ms  {module_name}")
+    print(f"  {sum(_import_times.values()) * 1000:8.1f} ms  total")
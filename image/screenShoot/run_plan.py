@@ -0,0 +1,87 @@
+import os
+import ast
+import datetime
+import unittest
+import shard_tests
+import affected_tests
+
+# Shown once in each runner's help
+SNAPSHOT_NOTE = (
+    "Sharded runs only read the --durations file and --impact-index; pass the same "
+    "snapshots to every shard. Both are updated once, from the merged reports (--merge).")
+
+def available_test_names():
+    """Return the test method names of ContractRenewalSystemTest without importing selenium.
+
+    This is the one list of tests the runners use for 'list', for checking a test
+    name and for running everything. It reads selenium_tests.py, so only test
+    methods defined directly in the class body are seen, not inherited ones.
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "selenium_tests.py")
+    with open(path) as f:
+        tree = ast.parse(f.read())
+    prefix = unittest.TestLoader.testMethodPrefix
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef) and node.name == "ContractRenewalSystemTest":
+            return sorted(item.name for item in node.body
+                          if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef))
+                          and item.name.startswith(prefix))
+    return []
+
+def check_test_names(test_case):
+    """Warn about tests unittest would find in the loaded class that available_test_names misses"""
+    names = available_test_names()
+    missing = sorted(set(unittest.TestLoader().getTestCaseNames(test_case)) - set(names))
+    if missing:
+        print(f"Warning: not running tests that are not defined in the class body: {', '.join(missing)}")
+    return names
+
+def plan_tests(test_names, shard=None, affected=None, durations=shard_tests.DURATIONS_FILE):
+    """Pick the tests to run: those affected by the changed files, then this shard of them.
+
+    affected holds keyword arguments for affected_tests.plan_run (or None to
+    run everything). Returns a plan dict to pass to report_dir_for and finish_run.
+    """
+    plan = {
+        "shard": shard,
+        "affected": affected,
+        "durations": durations,
+        "full_run": True,
+        "suite": list(test_names),
+    }
+    if affected is not None:
+        plan["suite"], plan["full_run"] = affected_tests.plan_run(test_names, **affected)
+    plan["tests"] = shard_tests.select_shard(plan["suite"], shard, durations) if shard else plan["suite"]
+    return plan
+
+def report_dir_for(plan):
+    """Timestamped report directory for a run, tagged with its shard if it has one"""
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    report_dir = f"test_reports/selenium_test_report_{timestamp}"
+    if plan["shard"]:
+        report_dir += "_shard" + plan["shard"].replace("/", "of")
+    return report_dir
+
+def finish_run(plan, report_dir=None):
+    """Record what the run learned once it has finished.
+
+    A normal run folds its durations (from the JUnit XML in report_dir, if any)
+    and page traces into the durations file and impact index. A shard leaves
+    both alone and writes its manifest and trace into report_dir for --merge.
+    """
+    affected = plan["affected"]
+    if plan["shard"]:
+        if report_dir is None:
+            print("Sharded run without an XML report: nothing is recorded for --merge")
+            return
+        shard_affected = None
+        if affected is not None:
+            shard_affected = affected_tests.save_shard_trace(report_dir, plan["full_run"], affected["index_path"])
+        shard_tests.write_shard_manifest(
+            report_dir, plan["shard"], plan["suite"], plan["tests"], plan["durations"], shard_affected)
+        return
+
+    if report_dir is not None:
+        shard_tests.record_durations(report_dir, plan["durations"])
+    if affected is not None:
+        affected_tests.update_index(plan["full_run"], path=affected["index_path"])
@@ -1,49 +1,83 @@
 import unittest
 import sys
-import inspect
 import os
+import atexit
 import datetime
-from selenium_tests import ContractRenewalSystemTest
+import flaky_tests
+import shard_tests
+import affected_tests
+import run_plan
+import lazy_imports
 
-# Try to import xmlrunner, install if not available
-try:
-    import xmlrunner
-except ImportError:
-    print("xmlrunner not found. Installing...")
-    import subprocess
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "unittest-xml-reporting"])
-    import xmlrunner
+# selenium_tests (and with it selenium) and xmlrunner are imported lazily through
+# lazy_imports, so 'list' and argument errors don't pay for loading them
+
+def load_test_case(xml_report=False):
+    """Import the test class, and xmlrunner when needed, failing fast if a dependency is missing"""
+    lazy_imports.check_dependencies("selenium_tests", *(["xmlrunner"] if xml_report else []))
+    return lazy_imports.load("selenium_tests").ContractRenewalSystemTest
 
 def list_available_tests():
     """List all available test methods in the ContractRenewalSystemTest class"""
     print("Available tests:")
-    for name, method in inspect.getmembers(ContractRenewalSystemTest, predicate=inspect.isfunction):
-        if name.startswith('test_'):
-            print(f"  - {name}")
-
-def run_all_tests(xml_report=False):
-    """Run all tests in the ContractRenewalSystemTest class"""
+    for name in run_plan.available_test_names():
+        print(f"  - {name}")
+
+def get_option(name, default, convert=int):
+    """Read an option given as '--name VALUE' or '--name=VALUE' on the command line"""
+    for i, arg in enumerate(sys.argv):
+        if arg == name and i + 1 < len(sys.argv):
+            value = sys.argv[i + 1]
+        elif arg.startswith(name + "="):
+            value = arg.split("=", 1)[1]
+        else:
+            continue
+        try:
+            return convert(value)
+        except ValueError:
+            print(f"Error: invalid value for {name}: '{value}'")
+            sys.exit(1)
+    return default
+
+def run_suite_with_retries(test_case, test_names, runner, retries=2, workers=4, report_dir=None):
+    """Run the given tests, rerunning only the failures and recording flaky tests.
+
+    If report_dir is given, tests that passed on retry are marked flaky in its JUnit XML.
+    """
+    result, retry_outcomes = flaky_tests.run_with_retries(
+        test_case, test_names, runner, retries, workers)
+    if report_dir:
+        flaky_tests.mark_flaky_in_xml(report_dir, retry_outcomes)
+    return flaky_tests.run_succeeded(result, retry_outcomes)
+
+def run_all_tests(xml_report=False, retries=2, workers=4, shard=None, affected=None,
+                  durations=shard_tests.DURATIONS_FILE):
+    """Run all tests in the ContractRenewalSystemTest class, or one duration-balanced shard of them.
+
+    If affected is given (keyword arguments for affected_tests.plan_run), only
+    the tests affected by the changed app files are run.
+    """
+    test_case = load_test_case(xml_report)
+    plan = run_plan.plan_tests(run_plan.check_test_names(test_case), shard, affected, durations)
     if xml_report:
         # Create reports directory if it doesn't exist
         if not os.path.exists('test_reports'):
             os.makedirs('test_reports')
         
-        # Generate timestamp for report filename
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        report_dir = f"test_reports/selenium_test_report_{timestamp}"
-        
-        runner = xmlrunner.XMLTestRunner(output=report_dir)
-        suite = unittest.TestLoader().loadTestsFromTestCase(ContractRenewalSystemTest)
-        runner.run(suite)
+        report_dir = run_plan.report_dir_for(plan)
+        runner = lazy_imports.load("xmlrunner").XMLTestRunner(output=report_dir)
+        success = run_suite_with_retries(test_case, plan["tests"], runner, retries, workers, report_dir)
+        run_plan.finish_run(plan, report_dir)
         print(f"XML report generated in: {report_dir}")
     else:
-        unittest.main(module='selenium_tests')
+        runner = unittest.TextTestRunner()
+        success = run_suite_with_retries(test_case, plan["tests"], runner, retries, workers)
+        run_plan.finish_run(plan)
+    return success
 
-def run_specific_test(test_name, xml_report=False):
+def run_specific_test(test_name, xml_report=False, retries=2, workers=4, durations=shard_tests.DURATIONS_FILE):
     """Run a specific test by name"""
-    suite = unittest.TestSuite()
-    suite.addTest(ContractRenewalSystemTest(test_name))
-    
+    test_case = load_test_case(xml_report)
     if xml_report:
         # Create reports directory if it doesn't exist
         if not os.path.exists('test_reports'):
@@ -53,12 +87,14 @@ def run_specific_test(test_name, xml_report=False):
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
         report_dir = f"test_reports/{test_name}_{timestamp}"
         
-        runner = xmlrunner.XMLTestRunner(output=report_dir)
-        runner.run(suite)
+        runner = lazy_imports.load("xmlrunner").XMLTestRunner(output=report_dir)
+        success = run_suite_with_retries(test_case, [test_name], runner, retries, workers, report_dir)
+        shard_tests.record_durations(report_dir, durations)
         print(f"XML report generated in: {report_dir}")
     else:
         runner = unittest.TextTestRunner()
-        runner.run(suite)
+        success = run_suite_with_retries(test_case, [test_name], runner, retries, workers)
+    return success
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
@@ -68,25 +104,59 @@ if __name__ == "__main__":
         print("  python run_selenium_tests.py list           # List available tests")
         print("  python run_selenium_tests.py test_name      # Run a specific test")
         print("  python run_selenium_tests.py test_name --xml  # Run a specific test with XML report")
+        print("")
+        print("Options:")
+        print("  --retries N    Rerun failed tests up to N times, marking passes as flaky (default: 2)")
+        print("  --workers N    Number of failed tests to rerun in parallel (default: 4)")
+        print("  --shard i/N    Run only shard i of N, balanced by recorded test durations (with 'all')")
+        print(f"  --durations PATH  Test durations file (default: {shard_tests.DURATIONS_FILE})")
+        print("  --affected     Run only tests affected by app files changed since --since (with 'all')")
+        print("  --since REF    Git revision to diff the app against for --affected (default: HEAD)")
+        print("  --app-dir DIR  App repository to diff for --affected (default: .)")
+        print("  --changed-files a,b  Use this list of changed files instead of git for --affected")
+        print("  --full-every N Force a full run every N --affected runs to refresh the index (default: 10)")
+        print(f"  --impact-index PATH  Test impact index for --affected (default: {affected_tests.INDEX_FILE})")
+        print("  --profile-startup  Print how long the lazily loaded dependencies took to import")
+        print("")
+        print(run_plan.SNAPSHOT_NOTE)
         sys.exit(1)
     
     command = sys.argv[1]
+    if "--profile-startup" in sys.argv:
+        atexit.register(lazy_imports.print_import_times)
     xml_report = "--xml" in sys.argv
+    retries = get_option("--retries", 2)
+    workers = get_option("--workers", 4)
+    shard = get_option("--shard", None, str)
+    durations = get_option("--durations", shard_tests.DURATIONS_FILE, str)
+    
+    if shard:
+        try:
+            shard_tests.parse_shard_spec(shard)
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+    
+    affected = None
+    if "--affected" in sys.argv:
+        affected = {
+            "since": get_option("--since", "HEAD", str),
+            "app_dir": get_option("--app-dir", ".", str),
+            "changed_files": get_option("--changed-files", None, lambda value: [f for f in value.split(",") if f]),
+            "full_run_every": get_option("--full-every", affected_tests.FULL_RUN_EVERY),
+            "index_path": get_option("--impact-index", affected_tests.INDEX_FILE, str),
+        }
     
     if command == "all":
-        run_all_tests(xml_report)
+        success = run_all_tests(xml_report, retries, workers, shard, affected, durations)
+        sys.exit(0 if success else 1)
     elif command == "list":
         list_available_tests()
     else:
         # Check if the test exists
-        test_exists = False
-        for name, method in inspect.getmembers(ContractRenewalSystemTest, predicate=inspect.isfunction):
-            if name == command and name.startswith('test_'):
-                test_exists = True
-                break
-        
-        if test_exists:
-            run_specific_test(command, xml_report)
+        if command in run_plan.available_test_names():
+            success = run_specific_test(command, xml_report, retries, workers, durations)
+            sys.exit(0 if success else 1)
         else:
             print(f"Error: Test '{command}' not found.")
             list_available_tests()
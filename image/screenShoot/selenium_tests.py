@@ -3,6 +3,7 @@ from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.events import EventFiringWebDriver, AbstractEventListener
 from selenium.common.exceptions import TimeoutException
 # If you want to import a module called solve
 import solve
@@ -10,6 +11,33 @@ import solve
 # from some_module import solve
 import os
 import time
+import json
+import threading
+
+# Serialises trace writes when failed tests are retried in parallel
+_trace_lock = threading.Lock()
+
+class UrlRecorder(AbstractEventListener):
+    """Remembers the page the browser is on after every navigation, click and element lookup"""
+    
+    def __init__(self, visited_urls):
+        self.visited_urls = visited_urls
+    
+    def record(self, driver):
+        # Clicks and form submits can land on other pages (and redirects), so read
+        # the URL from the browser rather than from what the test asked for
+        url = driver.current_url
+        if not self.visited_urls or self.visited_urls[-1] != url:
+            self.visited_urls.append(url)
+    
+    def after_navigate_to(self, url, driver):
+        self.record(driver)
+    
+    def after_click(self, element, driver):
+        self.record(driver)
+    
+    def after_find(self, by, value, driver):
+        self.record(driver)
 
 class ContractRenewalSystemTest(unittest.TestCase):
     """Test cases for Contract Renewal System UI"""
@@ -20,6 +48,11 @@ class ContractRenewalSystemTest(unittest.TestCase):
         self.take_screenshots = os.environ.get('TAKE_SCREENSHOTS', 'False').lower() == 'true'
         self.screenshots_dir = os.environ.get('SCREENSHOTS_DIR', 'test_reports/screenshots')
         
+        # Check if we should record the pages each test visits (used for change-based test selection)
+        self.record_urls = os.environ.get('RECORD_TEST_URLS', 'False').lower() == 'true'
+        self.url_trace_file = os.environ.get('URL_TRACE_FILE', 'test_reports/url_trace.jsonl')
+        self.visited_urls = []
+        
         # Create screenshots directory if needed
         if self.take_screenshots and not os.path.exists(self.screenshots_dir):
             os.makedirs(self.screenshots_dir)
@@ -27,13 +60,35 @@ class ContractRenewalSystemTest(unittest.TestCase):
         # Initialize WebDriver
         self.driver = webdriver.Chrome()  # Use Chrome driver
         self.driver.maximize_window()
+        if self.record_urls:
+            self.driver = EventFiringWebDriver(self.driver, UrlRecorder(self.visited_urls))
         self.base_url = "http://localhost:8000"  # Update with your application URL
         self.wait = WebDriverWait(self.driver, 10)  # 10 seconds timeout
     
     def tearDown(self):
         """Clean up after each test"""
         if self.driver:
-            self.driver.quit()
+            try:
+                if self.record_urls:
+                    self.save_visited_urls()
+            finally:
+                # Always quit, otherwise a failed trace write leaks a Chrome process
+                self.driver.quit()
+    
+    def save_visited_urls(self):
+        """Append the pages visited by this test to the URL trace file"""
+        try:
+            # Also keep the page the test ended on, e.g. after a redirect
+            UrlRecorder(self.visited_urls).record(self.driver)
+        except Exception:
+            pass
+        
+        directory = os.path.dirname(self.url_trace_file)
+        with _trace_lock:
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            with open(self.url_trace_file, 'a') as f:
+                f.write(json.dumps({"test": self._testMethodName, "urls": self.visited_urls}) + "\n")
     
     def take_screenshot(self, name):
         """Take a screenshot if enabled"""
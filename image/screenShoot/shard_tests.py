@@ -0,0 +1,205 @@
+import os
+import glob
+import heapq
+import xml.etree.ElementTree as ET
+import json_store
+
+# Sharded runs only read this file; it is updated from the merged report, so CI
+# should pass the same published snapshot to every shard with --durations
+DURATIONS_FILE = "test_reports/test_durations.json"
+
+# Written into each shard's report directory and checked when the shards are merged
+MANIFEST_FILE = "shard.json"
+
+# Weight of the newest run in the moving average of a test's duration
+DURATION_SMOOTHING = 0.5
+
+def load_durations(path=DURATIONS_FILE):
+    """Load recorded per-test durations, or an empty dict if none exist"""
+    return json_store.load_json(path, {})
+
+def save_durations(durations, path=DURATIONS_FILE):
+    """Write per-test durations to disk"""
+    json_store.save_json(path, durations)
+
+def read_xml_durations(report_dir):
+    """Return a dict of test method name -> seconds from the JUnit XML files in a report directory.
+
+    Only tests that passed on their first attempt are included: a failed or
+    flaky test's time is usually a WebDriverWait timeout, not its real duration.
+    """
+    timings = {}
+    for xml_file in glob.glob(f"{report_dir}/*.xml"):
+        try:
+            root = ET.parse(xml_file).getroot()
+        except ET.ParseError as e:
+            print(f"Error parsing XML results {xml_file}: {e}")
+            continue
+        for testcase in root.iter('testcase'):
+            if any(testcase.find(tag) is not None for tag in ('failure', 'error', 'skipped')):
+                continue
+            if any(p.get('name') == 'flaky' for p in testcase.iter('property')):
+                continue
+            timings[testcase.get('name')] = float(testcase.get('time', 0))
+    return timings
+
+def record_durations(report_dir, path=DURATIONS_FILE):
+    """Fold the durations from a JUnit XML report into the on-disk duration history"""
+    durations = load_durations(path)
+    for name, seconds in read_xml_durations(report_dir).items():
+        entry = durations.setdefault(name, {"average": seconds, "runs": 0})
+        entry["average"] = round(DURATION_SMOOTHING * seconds + (1 - DURATION_SMOOTHING) * entry["average"], 3)
+        entry["last"] = seconds
+        entry["runs"] += 1
+    save_durations(durations, path)
+    return durations
+
+def expected_duration(durations, test_name):
+    """Expected duration of a test; unseen tests are assumed to take the average known time"""
+    if test_name in durations:
+        return durations[test_name]["average"]
+    known = [entry["average"] for entry in durations.values()]
+    return sum(known) / len(known) if known else 1.0
+
+def build_shards(test_names, durations, shard_count):
+    """Split tests into shard_count balanced shards, longest-processing-time first.
+
+    Tests are taken from slowest to fastest and each one goes to the shard
+    with the least total expected time so far.
+    """
+    if shard_count < 1:
+        raise ValueError("shard count must be at least 1")
+
+    # Slowest first; ties broken by name so machines given the same durations compute the same shards
+    ordered = sorted(test_names, key=lambda name: (-expected_duration(durations, name), name))
+    shards = [[] for _ in range(shard_count)]
+    loads = [(0.0, index) for index in range(shard_count)]
+    heapq.heapify(loads)
+
+    for name in ordered:
+        load, index = heapq.heappop(loads)
+        shards[index].append(name)
+        heapq.heappush(loads, (load + expected_duration(durations, name), index))
+
+    return shards
+
+def parse_shard_spec(spec):
+    """Parse a '--shard i/N' value into a 1-based (index, count) tuple"""
+    try:
+        index, count = (int(part) for part in spec.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid shard '{spec}', expected the form i/N (e.g. 1/3)")
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError(f"Invalid shard '{spec}', index must be between 1 and N")
+    return index, count
+
+def select_shard(test_names, spec, durations_path=DURATIONS_FILE):
+    """Return the tests that belong to the shard described by an 'i/N' spec"""
+    index, count = parse_shard_spec(spec)
+    durations = load_durations(durations_path)
+    shard = build_shards(test_names, durations, count)[index - 1]
+    expected = sum(expected_duration(durations, name) for name in shard)
+    print(f"Shard {index}/{count}: {len(shard)} test(s), ~{expected:.1f}s expected "
+          f"(durations {durations_path}, snapshot {json_store.digest(durations)})")
+    return shard
+
+def write_shard_manifest(report_dir, spec, suite, shard, durations_path=DURATIONS_FILE, affected=None):
+    """Record which tests this shard ran, out of which suite, and with which durations snapshot.
+
+    affected holds the --affected details returned by affected_tests.save_shard_trace.
+    """
+    manifest = {
+        "shard": spec,
+        "suite": sorted(suite),
+        "tests": sorted(shard),
+        "durations_digest": json_store.digest(load_durations(durations_path)),
+    }
+    if affected is not None:
+        manifest["affected"] = affected
+    json_store.save_json(os.path.join(report_dir, MANIFEST_FILE), manifest)
+
+def check_shard_manifests(report_dirs):
+    """Warn when the shards being merged did not partition the suite consistently.
+
+    Returns a dict with the warnings, the missing shard indices and the tests
+    that no shard ran; the last two mean the merged report is incomplete.
+    """
+    manifests = []
+    for report_dir in report_dirs:
+        path = os.path.join(report_dir, MANIFEST_FILE)
+        if not os.path.exists(path):
+            print(f"⚠️  Warning: {report_dir} has no {MANIFEST_FILE}, cannot check it against the other shards")
+            continue
+        manifest = json_store.load_json(path, None)
+        if manifest:
+            manifests.append(manifest)
+    if not manifests:
+        return {"warnings": [], "missing_shards": [], "never_ran": []}
+
+    warnings = []
+    counts = {parse_shard_spec(m["shard"])[1] for m in manifests}
+    if len(counts) > 1:
+        warnings.append(f"shards were run with different shard counts: {sorted(counts)}")
+    digests = {m["durations_digest"] for m in manifests}
+    if len(digests) > 1:
+        warnings.append(f"shards used different durations snapshots ({', '.join(sorted(digests))}); pass the same --durations file to every shard")
+    if len({tuple(m["suite"]) for m in manifests}) > 1:
+        warnings.append("shards selected different sets of tests to split; with --affected, pass the same --impact-index and changed files to every shard")
+    index_digests = {m["affected"]["index_digest"] for m in manifests if "affected" in m}
+    if len(index_digests) > 1:
+        warnings.append(f"shards used different impact index snapshots ({', '.join(sorted(index_digests))})")
+    indices = [parse_shard_spec(m["shard"])[0] for m in manifests]
+    missing = sorted(set(range(1, max(counts) + 1)) - set(indices))
+    if missing:
+        warnings.append(f"missing shard(s): {', '.join(str(i) for i in missing)}")
+
+    ran = {}
+    for m in manifests:
+        for name in m["tests"]:
+            ran.setdefault(name, []).append(m["shard"])
+    for name, shards in sorted(ran.items()):
+        if len(shards) > 1:
+            warnings.append(f"{name} ran in more than one shard ({', '.join(shards)})")
+    suite = set()
+    for m in manifests:
+        suite.update(m["suite"])
+    never_ran = sorted(suite - set(ran))
+    if never_ran:
+        warnings.append(f"test(s) not run by any shard: {', '.join(never_ran)}")
+
+    for warning in warnings:
+        print(f"⚠️  Warning: {warning}")
+    return {"warnings": warnings, "missing_shards": missing, "never_ran": never_ran}
+
+def merge_xml_reports(report_dirs, output_dir):
+    """Merge the JUnit XML files of several shard report directories into one report"""
+    merged = ET.Element('testsuite', name="ContractRenewalSystemTest (merged shards)")
+    seen = {}
+
+    for report_dir in report_dirs:
+        for xml_file in sorted(glob.glob(f"{report_dir}/*.xml")):
+            try:
+                root = ET.parse(xml_file).getroot()
+            except ET.ParseError as e:
+                print(f"Error parsing XML results {xml_file}: {e}")
+                continue
+            for testcase in root.iter('testcase'):
+                # A test that ran on more than one shard keeps its last result
+                key = (testcase.get('classname'), testcase.get('name'))
+                if key in seen:
+                    merged.remove(seen[key])
+                seen[key] = testcase
+                merged.append(testcase)
+
+    testcases = merged.findall('testcase')
+    merged.set('tests', str(len(testcases)))
+    merged.set('failures', str(sum(1 for t in testcases if t.find('failure') is not None)))
+    merged.set('errors', str(sum(1 for t in testcases if t.find('error') is not None)))
+    merged.set('time', f"{sum(float(t.get('time', 0)) for t in testcases):.3f}")
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    output_file = os.path.join(output_dir, "TEST-merged.xml")
+    ET.ElementTree(merged).write(output_file, encoding="utf-8", xml_declaration=True)
+    print(f"Merged {len(testcases)} test result(s) into: {output_file}")
+    return output_file
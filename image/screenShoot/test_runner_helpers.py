@@ -0,0 +1,285 @@
+import os
+import json
+import sys
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+import xml.etree.ElementTree as ET
+import flaky_tests
+import shard_tests
+import affected_tests
+import lazy_imports
+import run_plan
+
+# Tests for the runner helpers; none of them needs selenium or a browser.
+# Run with: python -m unittest test_runner_helpers
+
+def write_junit_xml(report_dir, testcases, name="TEST-suite.xml"):
+    """Write a JUnit XML report; testcases is a list of (name, time, outcome tag or None)"""
+    suite = ET.Element("testsuite", name="ContractRenewalSystemTest", tests=str(len(testcases)),
+                       failures=str(sum(1 for _, _, tag in testcases if tag == "failure")),
+                       errors=str(sum(1 for _, _, tag in testcases if tag == "error")))
+    for test_name, test_time, tag in testcases:
+        testcase = ET.SubElement(suite, "testcase", classname="ContractRenewalSystemTest",
+                                 name=test_name, time=str(test_time))
+        if tag:
+            ET.SubElement(testcase, tag, message=f"{test_name} {tag}")
+    ET.ElementTree(suite).write(os.path.join(report_dir, name), encoding="utf-8", xml_declaration=True)
+
+class TempDirTestCase(unittest.TestCase):
+    """Runs each test inside its own temporary working directory"""
+
+    def setUp(self):
+        self.old_cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+
+    def tearDown(self):
+        os.chdir(self.old_cwd)
+        shutil.rmtree(self.tmp)
+
+class FlakyTestsTest(TempDirTestCase):
+    """flaky_tests: first-attempt outcomes, history and JUnit XML rewriting"""
+
+    def test_first_attempt_statuses(self):
+        # Defined here so the test loaders don't pick it up as a real test case
+        class SampleTest(unittest.TestCase):
+            def test_pass(self):
+                pass
+
+            def test_fail(self):
+                self.fail("boom")
+
+            def test_error(self):
+                raise RuntimeError("boom")
+
+            @unittest.skip("not today")
+            def test_skip(self):
+                pass
+
+        names = ["test_pass", "test_fail", "test_error", "test_skip"]
+        result = unittest.TestResult()
+        unittest.TestSuite(SampleTest(name) for name in names).run(result)
+        self.assertEqual(flaky_tests.first_attempt_statuses(result, names), {
+            "test_pass": "PASSED",
+            "test_fail": "FAILED",
+            "test_error": "ERROR",
+            "test_skip": "SKIPPED",
+        })
+
+    def test_update_history_does_not_count_skips_as_runs(self):
+        first_attempts = {"test_a": "PASSED", "test_b": "FAILED", "test_c": "ERROR", "test_d": "SKIPPED"}
+        history = flaky_tests.update_history({}, first_attempts, {"test_b": 1, "test_c": None})
+        self.assertEqual(history["test_a"]["passed"], 1)
+        self.assertEqual(history["test_b"]["flaky"], 1)
+        self.assertEqual(history["test_c"]["failed"], 1)
+        self.assertEqual(history["test_d"]["runs"], 0)
+        self.assertEqual(flaky_tests.flaky_score(history, "test_b"), 1.0)
+
+    def test_mark_flaky_in_xml(self):
+        write_junit_xml(self.tmp, [("test_a", 1.0, None), ("test_b", 2.0, "failure"), ("test_c", 3.0, "error")])
+        flaky_tests.mark_flaky_in_xml(self.tmp, {"test_b": 2, "test_c": None})
+
+        suite = ET.parse(os.path.join(self.tmp, "TEST-suite.xml")).getroot()
+        testcases = {t.get("name"): t for t in suite.iter("testcase")}
+        self.assertIsNone(testcases["test_b"].find("failure"))
+        properties = {p.get("name"): p.get("value") for p in testcases["test_b"].iter("property")}
+        self.assertEqual(properties["flaky"], "true")
+        self.assertEqual(properties["rerun"], "2")
+        self.assertEqual(properties["first_attempt"], "test_b failure")
+        # A test that never passed keeps its error
+        self.assertIsNotNone(testcases["test_c"].find("error"))
+        self.assertEqual(suite.get("failures"), "0")
+        self.assertEqual(suite.get("errors"), "1")
+
+class ShardTestsTest(TempDirTestCase):
+    """shard_tests: duration balancing, manifests and merging shard reports"""
+
+    durations = {
+        "test_a": {"average": 8.0, "runs": 1},
+        "test_b": {"average": 5.0, "runs": 1},
+        "test_c": {"average": 4.0, "runs": 1},
+        "test_d": {"average": 3.0, "runs": 1},
+    }
+
+    def test_build_shards_balances_by_duration(self):
+        shards = shard_tests.build_shards(["test_a", "test_b", "test_c", "test_d"], self.durations, 2)
+        self.assertEqual(shards, [["test_a", "test_d"], ["test_b", "test_c"]])
+
+    def test_build_shards_covers_every_test_once(self):
+        names = ["test_a", "test_b", "test_c", "test_d", "test_new"]
+        shards = shard_tests.build_shards(names, self.durations, 3)
+        self.assertEqual(sorted(name for shard in shards for name in shard), names)
+        # The same durations give the same shards whatever order the names come in
+        self.assertEqual(shard_tests.build_shards(list(reversed(names)), self.durations, 3), shards)
+
+    def test_parse_shard_spec(self):
+        self.assertEqual(shard_tests.parse_shard_spec("2/3"), (2, 3))
+        for spec in ("0/3", "4/3", "1", "a/b"):
+            with self.assertRaises(ValueError):
+                shard_tests.parse_shard_spec(spec)
+
+    def make_shard(self, spec, tests, suite, outcomes=None):
+        """Create a shard report directory with a manifest and a JUnit XML report"""
+        report_dir = os.path.join(self.tmp, "shard" + spec.replace("/", "of"))
+        os.makedirs(report_dir)
+        outcomes = outcomes or {}
+        write_junit_xml(report_dir, [(name, 1.0, outcomes.get(name)) for name in tests])
+        shard_tests.write_shard_manifest(report_dir, spec, suite, tests, "durations.json")
+        return report_dir
+
+    def test_merge_complete_shards(self):
+        suite = ["test_a", "test_b", "test_c"]
+        report_dirs = [self.make_shard("1/2", ["test_a", "test_c"], suite, {"test_c": "failure"}),
+                       self.make_shard("2/2", ["test_b"], suite)]
+        check = shard_tests.check_shard_manifests(report_dirs)
+        self.assertEqual(check, {"warnings": [], "missing_shards": [], "never_ran": []})
+
+        output_file = shard_tests.merge_xml_reports(report_dirs, os.path.join(self.tmp, "merged"))
+        merged = ET.parse(output_file).getroot()
+        self.assertEqual(sorted(t.get("name") for t in merged.iter("testcase")), suite)
+        self.assertEqual(merged.get("tests"), "3")
+        self.assertEqual(merged.get("failures"), "1")
+
+    def test_check_reports_missing_shards_and_tests(self):
+        suite = ["test_a", "test_b", "test_c"]
+        report_dirs = [self.make_shard("1/3", ["test_a"], suite), self.make_shard("3/3", ["test_c"], suite)]
+        check = shard_tests.check_shard_manifests(report_dirs)
+        self.assertEqual(check["missing_shards"], [2])
+        self.assertEqual(check["never_ran"], ["test_b"])
+
+    def test_check_warns_about_different_snapshots(self):
+        suite = ["test_a", "test_b"]
+        first = self.make_shard("1/2", ["test_a"], suite)
+        shard_tests.save_durations(self.durations, "durations.json")
+        second = self.make_shard("2/2", ["test_b"], suite)
+        warnings = shard_tests.check_shard_manifests([first, second])["warnings"]
+        self.assertTrue(any("different durations snapshots" in warning for warning in warnings))
+
+    def test_record_durations_skips_failed_and_flaky_tests(self):
+        write_junit_xml(self.tmp, [("test_a", 2.0, None), ("test_b", 10.0, "failure"), ("test_c", 10.0, "failure")])
+        flaky_tests.mark_flaky_in_xml(self.tmp, {"test_c": 1})
+        durations = shard_tests.record_durations(self.tmp, "durations.json")
+        self.assertEqual(sorted(durations), ["test_a"])
+        self.assertEqual(durations["test_a"]["average"], 2.0)
+
+class AffectedTestsTest(TempDirTestCase):
+    """affected_tests: picking tests from changed files and maintaining the impact index"""
+
+    route_map = {
+        "routes": {"/login/": ["accounts/*"], "/dashboard/": ["dashboard/*"]},
+        "global": ["*/settings.py"],
+        "ignore": ["*.md"],
+    }
+
+    def write_trace(self, path, test_name, urls):
+        with open(path, "a") as f:
+            f.write(json.dumps({"test": test_name, "urls": urls}) + "\n")
+
+    def make_index(self):
+        self.write_trace("trace.jsonl", "test_login", ["http://localhost:8000/login/"])
+        self.write_trace("trace.jsonl", "test_dashboard",
+                         ["http://localhost:8000/login/", "http://localhost:8000/dashboard/"])
+        return affected_tests.update_index(True, ["trace.jsonl"], self.route_map, "index.json")
+
+    def select(self, changed_files, index=None):
+        tests = ["test_login", "test_dashboard", "test_new"]
+        return affected_tests.select_tests(tests, changed_files, index or self.make_index(), self.route_map)
+
+    def test_select_only_affected_tests(self):
+        self.assertEqual(self.select(["dashboard/views.py", "README.md"]), (["test_dashboard", "test_new"], None))
+        self.assertEqual(self.select(["accounts/views.py"]), (["test_login", "test_dashboard", "test_new"], None))
+
+    def test_select_falls_back_to_a_full_run(self):
+        everything = ["test_login", "test_dashboard", "test_new"]
+        for changed_files in (None, [], ["config/settings.py"], ["reports/views.py"]):
+            selected, reason = self.select(changed_files)
+            self.assertEqual(selected, everything)
+            self.assertIsNotNone(reason)
+        selected, reason = self.select(["dashboard/views.py"], {"tests": {}, "runs_since_full": 0})
+        self.assertEqual(reason, "no test impact index yet")
+
+    def test_periodic_full_run(self):
+        index = self.make_index()
+        index["runs_since_full"] = affected_tests.FULL_RUN_EVERY
+        self.assertIsNotNone(self.select(["dashboard/views.py"], index)[1])
+
+    def test_update_index_keeps_pages_from_earlier_runs(self):
+        self.make_index()
+        # A later run where the dashboard test failed before reaching the dashboard
+        self.write_trace("short.jsonl", "test_dashboard", ["http://localhost:8000/login/"])
+        index = affected_tests.update_index(False, ["short.jsonl"], self.route_map, "index.json")
+        self.assertEqual(index["tests"]["test_dashboard"]["urls"], ["/dashboard/", "/login/"])
+        self.assertEqual(index["tests"]["test_dashboard"]["files"], ["accounts/*", "dashboard/*"])
+        self.assertEqual(index["runs_since_full"], 1)
+
+    def test_changed_files_are_relative_to_the_app_dir(self):
+        app_dir = os.path.join(self.tmp, "app")
+        os.makedirs(os.path.join(app_dir, "accounts"))
+        with open(os.path.join(app_dir, "accounts", "views.py"), "w") as f:
+            f.write("old\n")
+        git = ["git", "-c", "user.name=test", "-c", "user.email=test@example.com"]
+        subprocess.check_call(git + ["init", "-q"], cwd=self.tmp)
+        subprocess.check_call(git + ["add", "."], cwd=self.tmp)
+        subprocess.check_call(git + ["commit", "-q", "-m", "initial"], cwd=self.tmp)
+        with open(os.path.join(app_dir, "accounts", "views.py"), "a") as f:
+            f.write("new\n")
+        with open(os.path.join(app_dir, "accounts", "forms.py"), "w") as f:
+            f.write("new\n")
+        changed = affected_tests.changed_files_from_git("HEAD", app_dir)
+        self.assertEqual(sorted(changed), ["accounts/forms.py", "accounts/views.py"])
+
+class LazyImportsTest(TempDirTestCase):
+    """lazy_imports: loading on first use and failing fast when a dependency is missing"""
+
+    def setUp(self):
+        super().setUp()
+        sys.path.insert(0, self.tmp)
+        # Pretend this made-up package is a known third-party dependency
+        self.pip_names = mock.patch.dict(lazy_imports.PIP_NAMES, {"no_such_package": "no-such-package"})
+        self.pip_names.start()
+
+    def tearDown(self):
+        self.pip_names.stop()
+        sys.path.remove(self.tmp)
+        sys.modules.pop("local_module", None)
+        super().tearDown()
+
+    def test_load_imports_and_times_the_module(self):
+        self.assertIs(lazy_imports.load("json"), json)
+        self.assertIn("json", lazy_imports._import_times)
+
+    def test_missing_third_party_module_suggests_pip_install(self):
+        with self.assertRaises(SystemExit) as raised:
+            lazy_imports.load("no_such_package")
+        self.assertIn("pip install no-such-package", str(raised.exception.code))
+
+    def test_local_module_reports_the_dependency_it_is_missing(self):
+        with open("local_module.py", "w") as f:
+            f.write("import no_such_package\n")
+        with self.assertRaises(SystemExit) as raised:
+            lazy_imports.load("local_module")
+        self.assertIn("pip install no-such-package", str(raised.exception.code))
+
+    def test_missing_unknown_module_gets_no_pip_hint(self):
+        with self.assertRaises(SystemExit) as raised:
+            lazy_imports.load("no_such_local_module")
+        self.assertNotIn("pip install", str(raised.exception.code))
+
+    def test_check_dependencies_reports_every_missing_module(self):
+        with self.assertRaises(SystemExit) as raised:
+            lazy_imports.check_dependencies("json", "no_such_package", "no_such_local_module")
+        message = str(raised.exception.code)
+        self.assertIn("no_such_package", message)
+        self.assertIn("no_such_local_module", message)
+
+    def test_available_test_names_reads_the_source(self):
+        names = run_plan.available_test_names()
+        self.assertTrue(names)
+        self.assertEqual(names, sorted(names))
+        self.assertTrue(all(name.startswith("test") for name in names))
+
+if __name__ == "__main__":
+    unittest.main()